@@ -2,9 +2,11 @@ from flask import Flask, render_template, request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
 import os
 import shutil
+import uuid
 from pathlib import Path
-from handle_query import rag_query, pubmed_query
+from handle_query import rag_query, pubmed_query, get_filter_options
 from index_papers import index_papers
+from project_lock import project_write_lock, ProjectLockedError
 import config
 
 app = Flask(__name__)
@@ -53,13 +55,16 @@ def query_pubmed():
     data = request.json
     query = data.get('query', '')
     k = data.get('k', config.k)
+    filters = data.get('filters')
     
     if not query:
         return jsonify({'error': 'Query required'}), 400
     
     try:
-        response = pubmed_query(query, k=k)
+        response = pubmed_query(query, k=k, filters=filters)
         return jsonify({'success': True, 'response': response})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -118,7 +123,16 @@ def upload_papers(project_name):
             filename = secure_filename(file.filename)
             if filename.lower().endswith('.pdf'):
                 filepath = os.path.join(papers_path, filename)
-                file.save(filepath)
+                # Write under a temporary name and rename into place so a
+                # concurrent index job never globs a half-written PDF
+                tmp_path = f"{filepath}.{uuid.uuid4().hex}.part"
+                try:
+                    file.save(tmp_path)
+                    os.replace(tmp_path, filepath)
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
                 uploaded.append(filename)
     
     return jsonify({'success': True, 'uploaded': uploaded})
@@ -134,12 +148,21 @@ def index_project(project_name):
         return jsonify({'error': 'Project not found'}), 404
     
     try:
-        index_papers(project_name)
+        index_papers(project_name, blocking=False)
         return jsonify({'success': True, 'message': f'Successfully indexed project: {project_name}'})
+    except ProjectLockedError as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/projects/<project_name>/filters', methods=['GET'])
+def list_filters(project_name):
+    """List the papers, sections and year range a project can be filtered by"""
+    project_name = secure_filename(project_name)
+    return jsonify(get_filter_options(project_name))
+
+
 @app.route('/api/projects/<project_name>/query', methods=['POST'])
 def query_project(project_name):
     """Query a project's indexed papers"""
@@ -151,13 +174,16 @@ def query_project(project_name):
     data = request.json
     query = data.get('query', '')
     k = data.get('k', config.k)
+    filters = data.get('filters')
     
     if not query:
         return jsonify({'error': 'Query required'}), 400
     
     try:
-        response = rag_query(query, project_name=project_name, k=k)
+        response = rag_query(query, project_name=project_name, k=k, filters=filters)
         return jsonify({'success': True, 'response': response})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -172,8 +198,11 @@ def delete_project(project_name):
         return jsonify({'error': 'Project not found'}), 404
     
     try:
-        shutil.rmtree(project_path)
+        with project_write_lock(project_name, blocking=False):
+            shutil.rmtree(project_path)
         return jsonify({'success': True, 'message': f'Project {project_name} deleted'})
+    except ProjectLockedError as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -0,0 +1,71 @@
+import config
+import os
+import threading
+from contextlib import contextmanager
+
+
+# index_path -> {'project', 'client', 'users'}. chromadb shares one system per
+# directory, so there must never be two live clients for the same path here.
+_reader_clients = {}
+_reader_clients_lock = threading.Lock()
+
+
+def close_client(client):
+    """
+    Stop a PersistentClient and drop it from chromadb's per-path cache.
+
+    chromadb keeps one system per directory for the life of the process and
+    has no public way to release it. Every index version has its own
+    directory, so without this each one would keep its memory and file
+    handles open.
+    """
+    from chromadb.api.shared_system_client import SharedSystemClient
+
+    system = SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+    if system is not None:
+        system.stop()
+
+
+def _close_idle_clients(project_name):
+    """Close clients of a project no query uses that aren't its current version"""
+    current_path = os.path.normpath(config.get_index_path(project_name))
+    for index_path, entry in list(_reader_clients.items()):
+        if (entry['project'] == project_name and entry['users'] == 0
+                and os.path.normpath(index_path) != current_path):
+            close_client(entry['client'])
+            del _reader_clients[index_path]
+
+
+@contextmanager
+def reader_client(project_name, index_path):
+    """
+    Share one PersistentClient per index version between queries.
+
+    Clients are reference counted by path, so a query still leasing an older
+    version reuses that version's client rather than opening a second one on
+    the same chromadb system. A client is closed once no query uses it and
+    its version is no longer the project's current one.
+
+    Yields:
+        PersistentClient for index_path
+    """
+    import chromadb
+
+    with _reader_clients_lock:
+        entry = _reader_clients.get(index_path)
+        if entry is None:
+            entry = {
+                'project': project_name,
+                'client': chromadb.PersistentClient(path=index_path),
+                'users': 0
+            }
+            _reader_clients[index_path] = entry
+        entry['users'] += 1
+        _close_idle_clients(project_name)
+
+    try:
+        yield entry['client']
+    finally:
+        with _reader_clients_lock:
+            entry['users'] -= 1
+            _close_idle_clients(project_name)
@@ -1,15 +1,33 @@
 # Project configuration
 PROJECTS_DIR = "projects/"
+LOCKS_DIR = "locks/"
+LOCK_POLL_INTERVAL = 0.1  # Seconds between attempts to take a held lock
 
 # Indexing configuration
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 CHROMA_COLLECTION_NAME = "papers"
+FILTERS_FILENAME = "filters.json"  # Filter values precomputed per index version
+# Near-duplicate chunk removal before embedding (MinHash/LSH over word shingles)
+DEDUP_ENABLED = True
+DEDUP_THRESHOLD = 0.8  # Jaccard similarity at which chunks count as duplicates
+DEDUP_SHINGLE_SIZE = 5
+DEDUP_NUM_PERM = 128
+DEDUP_LSH_BANDS = 32  # Must divide DEDUP_NUM_PERM
+# Queries hold a shared lock on this file inside the index version they read,
+# so retired versions are only deleted once no query is using them
+READER_LOCK_FILENAME = "readers.lock"
+READ_LEASE_ATTEMPTS = 3  # Times a query re-reads the pointer if its version vanished
 
 # Query configuration
 k = 5
 HF_MODEL = "deepseek-ai/DeepSeek-V3.2:novita"
+# Context packing: retrieved chunks are trimmed to fit this many prompt tokens
+CONTEXT_TOKEN_BUDGET = 2000
+CONTEXT_MAX_CHUNK_TOKENS = 400  # Longer chunks are split before packing
+CONTEXT_MIN_OVERLAP_CHARS = 30  # Shortest shared text trimmed between neighbours
+CHARS_PER_TOKEN = 4  # Approximation used to estimate token counts
 
 
 # Helper functions for project paths
@@ -21,6 +39,34 @@ def get_papers_path(project_name):
     """Get the papers directory for a project"""
     return f"{PROJECTS_DIR}{project_name}/papers/"
 
-def get_index_path(project_name):
-    """Get the ChromaDB index directory for a project"""
+def get_lock_path(project_name):
+    """Get the lock file guarding writes to a project's index"""
+    return f"{LOCKS_DIR}{project_name}.lock"
+
+def get_index_versions_path(project_name):
+    """Get the directory holding every built index version for a project"""
+    return f"{PROJECTS_DIR}{project_name}/index_versions/"
+
+def get_index_pointer_path(project_name):
+    """Get the file naming the index version a project currently serves"""
+    return f"{PROJECTS_DIR}{project_name}/CURRENT_INDEX"
+
+def get_legacy_index_path(project_name):
+    """Get the unversioned index directory used before versioned indexes"""
     return f"{PROJECTS_DIR}{project_name}/vector_index/"
+
+def get_filters_path(project_name):
+    """Get the precomputed filter options of a project's current index"""
+    return f"{get_index_path(project_name)}{FILTERS_FILENAME}"
+
+def get_index_path(project_name):
+    """Get the ChromaDB index directory a project currently serves"""
+    pointer_path = get_index_pointer_path(project_name)
+    try:
+        with open(pointer_path, encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        version = ""
+    if not version:
+        return get_legacy_index_path(project_name)
+    return f"{get_index_versions_path(project_name)}{version}/"
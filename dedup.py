@@ -0,0 +1,166 @@
+import config
+import re
+import zlib
+from collections import defaultdict
+import numpy as np
+
+
+# Mersenne prime used for the MinHash permutations (a * x + b) % prime
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def shingle(text, size=None):
+    """
+    Split text into a set of hashed word shingles.
+
+    Text is lowercased and reduced to alphanumeric words first, so differences
+    in whitespace, punctuation or line breaks don't hide duplicates.
+    """
+    if size is None:
+        size = config.DEDUP_SHINGLE_SIZE
+
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(' '.join(words).encode('utf-8'))}
+
+    return {
+        zlib.crc32(' '.join(words[i:i + size]).encode('utf-8'))
+        for i in range(len(words) - size + 1)
+    }
+
+
+def minhash_signatures(shingle_sets, num_perm=None, seed=1):
+    """
+    Compute a MinHash signature for every shingle set.
+
+    Returns:
+        Array of shape (len(shingle_sets), num_perm)
+    """
+    if num_perm is None:
+        num_perm = config.DEDUP_NUM_PERM
+
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint64)
+    for i, shingles in enumerate(shingle_sets):
+        hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        # a and hashes are both < 2^32, so the product fits in 64 bits
+        permuted = (np.outer(hashes, a) + b) % _MERSENNE_PRIME
+        signatures[i] = permuted.min(axis=0)
+    return signatures
+
+
+def candidate_pairs(signatures, bands=None):
+    """
+    Find pairs of chunks whose signatures collide in at least one LSH band.
+    """
+    if bands is None:
+        bands = config.DEDUP_LSH_BANDS
+
+    num_perm = signatures.shape[1]
+    rows = num_perm // bands
+
+    pairs = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        band_slice = signatures[:, band * rows:(band + 1) * rows]
+        for i, row in enumerate(band_slice):
+            buckets[row.tobytes()].append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    return pairs
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def dedup_chunks(chunks, threshold=None):
+    """
+    Drop near-duplicate chunks before they are embedded.
+
+    Candidate pairs come from MinHash/LSH and are confirmed with the exact
+    Jaccard similarity of their word shingles. Each group of duplicates is
+    collapsed into its first chunk, whose metadata records the sources and
+    pages of the chunks merged into it. The merged chunks' own metadata is
+    kept under 'merged_metadata', so paper and section filters still find
+    the chunk through any of them.
+
+    Only chunks with the same publication year are merged, so a year filter
+    never drops a chunk that one of its duplicates would have matched.
+
+    Args:
+        chunks: List of chunk dicts with 'text' and 'metadata'
+        threshold: Minimum Jaccard similarity to treat chunks as duplicates.
+            If None, uses config.DEDUP_THRESHOLD
+
+    Returns:
+        Tuple of (deduplicated chunks, report dict)
+    """
+    if threshold is None:
+        threshold = config.DEDUP_THRESHOLD
+
+    shingle_sets = [shingle(chunk['text']) for chunk in chunks]
+
+    parents = list(range(len(chunks)))
+    if len(chunks) > 1:
+        signatures = minhash_signatures(shingle_sets)
+        for i, j in candidate_pairs(signatures):
+            if chunks[i]['metadata'].get('year') != chunks[j]['metadata'].get('year'):
+                continue
+            if jaccard(shingle_sets[i], shingle_sets[j]) >= threshold:
+                root_i, root_j = _find(parents, i), _find(parents, j)
+                if root_i != root_j:
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = defaultdict(list)
+    for i in range(len(chunks)):
+        groups[_find(parents, i)].append(i)
+
+    kept = []
+    for root in sorted(groups):
+        members = groups[root]
+        chunk = chunks[root]
+        if len(members) > 1:
+            merged = [
+                f"{chunks[i]['metadata'].get('source', 'Unknown')} "
+                f"(p. {chunks[i]['metadata'].get('page(s)', 'N/A')})"
+                for i in members[1:]
+            ]
+            # Chroma metadata values must be scalars, so join into one string
+            chunk = {
+                'text': chunk['text'],
+                'metadata': {
+                    **chunk['metadata'],
+                    'merged_sources': "; ".join(merged),
+                    'duplicate_count': len(members) - 1
+                },
+                'merged_metadata': [chunks[i]['metadata'] for i in members[1:]]
+            }
+        kept.append(chunk)
+
+    chars_before = sum(len(chunk['text']) for chunk in chunks)
+    chars_after = sum(len(chunk['text']) for chunk in kept)
+    report = {
+        'chunks_before': len(chunks),
+        'chunks_after': len(kept),
+        'chunks_removed': len(chunks) - len(kept),
+        'chars_before': chars_before,
+        'chars_after': chars_after,
+        'percent_saved': 100 * (chars_before - chars_after) / chars_before if chars_before else 0.0
+    }
+    return kept, report
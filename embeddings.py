@@ -0,0 +1,17 @@
+import config
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_embedding_model():
+    """
+    Load the embedding model once per process and reuse it afterwards.
+
+    sentence_transformers is imported here rather than at module level so the
+    web app can start serving before torch has been loaded.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(config.EMBEDDING_MODEL)
+    print(f"Loaded embedding model: {config.EMBEDDING_MODEL}")
+    return model
@@ -0,0 +1,27 @@
+# Run with: gunicorn -c gunicorn.conf.py app:app
+import gc
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+timeout = 600  # Indexing a project runs inside the request
+
+# Import the app and load the embedding model once in the master process, so
+# forked workers share it copy-on-write instead of each loading their own.
+# Set PRELOAD_APP=0 to load lazily in every worker instead.
+preload_app = os.getenv("PRELOAD_APP", "1") == "1"
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+
+    # The tokenizers thread pool must not be started before forking
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    from embeddings import get_embedding_model
+    get_embedding_model()
+
+    # Keep the garbage collector from touching (and so copying) the model's
+    # objects in each worker
+    gc.freeze()
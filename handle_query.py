@@ -1,10 +1,13 @@
-from sentence_transformers import SentenceTransformer
 import config
-import chromadb
 from dotenv import load_dotenv
+from chroma_clients import reader_client
+from embeddings import get_embedding_model
 from index_pubmed import update_pubmed_queue
+from pack_context import pack_context
+from project_lock import index_read_lease
+import json
 import os
-from openai import OpenAI
+import time
 
 load_dotenv()
 
@@ -14,32 +17,205 @@ def embed(model, sentence):
     return embedding.tolist()
 
 
-def find_k_relevant_chunks(reference, index_path, k=5):
+def _read_filter_options(filters_path):
+    try:
+        with open(filters_path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'papers': [], 'sections': [], 'year_min': None, 'year_max': None}
+
+
+def get_filter_options(project_name):
+    """
+    Get the papers, sections and year range a project's index can be filtered by.
+
+    Returns:
+        Dict with 'papers', 'sections', 'year_min' and 'year_max'. Lists are
+        empty if the project isn't indexed or its index predates filter options
+    """
+    filter_options = _read_filter_options(config.get_filters_path(project_name))
+    # Only queries need the chunk ids
+    filter_options.pop('chunk_members', None)
+    return filter_options
+
+
+def validate_filters(filters):
+    """
+    Check the types of query filters and normalize them.
+
+    Args:
+        filters: Dict with any of 'papers' and 'sections' (lists of values to
+            match) and 'year_min' / 'year_max' (inclusive bounds)
+
+    Returns:
+        Dict with 'papers' and 'sections' (lists, empty if unset) and
+        'year_min' and 'year_max' (ints, or None if unset)
+
+    Raises:
+        ValueError: If filters or any of its values has the wrong type
+    """
+    if not filters:
+        filters = {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+
+    validated = {}
+    for key in ('papers', 'sections'):
+        values = filters.get(key) or []
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError(f"{key} must be a list of strings")
+        validated[key] = values
+    for key in ('year_min', 'year_max'):
+        value = filters.get(key)
+        if value is None or value == '':
+            validated[key] = None
+            continue
+        if isinstance(value, bool):
+            raise ValueError(f"Invalid {key}: {value}")
+        try:
+            validated[key] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid {key}: {value}")
+    return validated
+
+
+def check_year_filter(filters, filter_options, project_name):
+    """
+    Reject a year filter on an index without publication years.
+
+    Without this the search silently matches nothing.
+
+    Args:
+        filters: Filters returned by validate_filters
+        filter_options: Filter options of the index version being searched
+        project_name: Name of the project
+    """
+    has_year_filter = filters['year_min'] is not None or filters['year_max'] is not None
+    if has_year_filter and filter_options.get('year_min') is None:
+        raise ValueError(f"Project '{project_name}' has no publication years to filter by")
+
+
+def filter_chunk_ids(filters, filter_options, project_name):
+    """
+    Find the chunks that match the paper and section filters.
+
+    A deduplicated chunk matches if any of the chunks merged into it does,
+    so filtering by a paper also finds its text that was merged into a
+    chunk from another paper.
+
+    Args:
+        filters: Filters returned by validate_filters
+        filter_options: Filter options of the index version being searched
+        project_name: Name of the project
+
+    Returns:
+        List of matching chunk ids, or None if no paper or section filter is set
+
+    Raises:
+        ValueError: If a paper or section isn't in the index
+    """
+    papers = set(filters['papers'])
+    sections = set(filters['sections'])
+    if not papers and not sections:
+        return None
+    if 'chunk_members' not in filter_options:
+        raise ValueError(f"Re-index project '{project_name}' to filter it by papers or sections")
+
+    for key, values in (('papers', papers), ('sections', sections)):
+        unknown = values - set(filter_options[key])
+        if unknown:
+            raise ValueError(f"Unknown {key} in project '{project_name}': {', '.join(sorted(unknown))}")
+
+    return [
+        chunk_id for chunk_id, members in filter_options['chunk_members'].items()
+        if any((not papers or source in papers) and (not sections or section in sections)
+               for source, section in members)
+    ]
+
+
+def build_where(filters):
+    """
+    Turn the year range of query filters into a ChromaDB where clause.
+
+    Papers and sections are matched by chunk id instead, see filter_chunk_ids.
+    Duplicates are only merged within a year, so the year in a chunk's
+    metadata holds for every chunk merged into it.
+
+    Args:
+        filters: Dict with optional 'year_min' / 'year_max' (inclusive bounds)
+
+    Returns:
+        The where clause, or None if no year range is set
+
+    Raises:
+        ValueError: If filters or any of its values has the wrong type
+    """
+    filters = validate_filters(filters)
+
+    conditions = []
+    for key, operator in (('year_min', '$gte'), ('year_max', '$lte')):
+        if filters[key] is not None:
+            conditions.append({'year': {operator: filters[key]}})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {'$and': conditions}
+
+
+def find_k_relevant_chunks(reference, project_name, k=5, filters=None, index_path=None):
     """
     Find k most relevant chunks from the indexed papers.
+
+    The project's current index version is leased for the duration of the
+    search, so a concurrent re-index can't delete it mid-query. Filters are
+    checked against that same version.
     
     Args:
         reference: The embedding vector to search for
-        index_path: Path to the ChromaDB index directory
+        project_name: Name of the project whose index to search
         k: Number of results to return
+        filters: Optional dict restricting the search, see validate_filters
+        index_path: Search this index version instead of the current one
+
+    Returns:
+        List of dicts with 'text', 'metadata', 'distance' and 'embedding'
     """
-    client = chromadb.PersistentClient(path=index_path)
-    collection = client.get_collection(name=config.CHROMA_COLLECTION_NAME)
+    filters = validate_filters(filters)
 
-    results = collection.query(
-        query_embeddings=[reference],
-        n_results=k,
-        include=["documents", "metadatas", "distances"]
-    )
+    with index_read_lease(project_name, index_path) as index_path, \
+            reader_client(project_name, index_path) as client:
+        ids = None
+        if any(filters.values()):
+            filter_options = _read_filter_options(os.path.join(index_path, config.FILTERS_FILENAME))
+            check_year_filter(filters, filter_options, project_name)
+            ids = filter_chunk_ids(filters, filter_options, project_name)
+            if ids is not None and not ids:
+                # No chunk is in both the filtered papers and sections
+                return []
+
+        collection = client.get_collection(name=config.CHROMA_COLLECTION_NAME)
+
+        results = collection.query(
+            query_embeddings=[reference],
+            n_results=k,
+            ids=ids,
+            where=build_where(filters),
+            include=["documents", "metadatas", "distances", "embeddings"]
+        )
 
     relevant_chunks = []
-    for doc, meta, dist in zip(results['documents'][0], results['metadatas'][0], results['distances'][0]):
-        paper = meta.get('source', 'Unknown')
-        page = meta.get('page(s)', 'N/A')
-        chunk = f"{doc} (From: {paper}, Page(s): {page}, Similarity: {dist:.4f})"
-        relevant_chunks.append(chunk)
+    for doc, meta, dist, emb in zip(results['documents'][0], results['metadatas'][0],
+                                    results['distances'][0], results['embeddings'][0]):
+        relevant_chunks.append({
+            'text': doc,
+            'metadata': meta,
+            'distance': dist,
+            'embedding': emb
+        })
     
-    return "\n\n".join(relevant_chunks)
+    return relevant_chunks
 
 
 def build_new_query(context, original_query):
@@ -57,6 +233,8 @@ def build_new_query(context, original_query):
 
 
 def ping_llm(system_prompt, user_prompt):
+    from openai import OpenAI
+
     api_key = os.getenv("API_KEY")
     
     client = OpenAI(
@@ -64,6 +242,7 @@ def ping_llm(system_prompt, user_prompt):
         api_key=api_key,
     )
 
+    start = time.perf_counter()
     completion = client.chat.completions.create(
         model=config.HF_MODEL,
         messages=[
@@ -78,10 +257,16 @@ def ping_llm(system_prompt, user_prompt):
         ],
     )
 
+    latency = time.perf_counter() - start
+
+    usage = completion.usage
+    prompt_tokens = usage.prompt_tokens if usage else "N/A"
+    print(f"LLM call: {latency:.2f}s, prompt tokens: {prompt_tokens}")
+
     return completion.choices[0].message
 
 
-def rag_query(original_query, project_name=None, k=None):
+def rag_query(original_query, project_name=None, k=None, filters=None, index_path=None):
     """
     Perform a RAG query on a project's indexed papers.
     
@@ -89,6 +274,8 @@ def rag_query(original_query, project_name=None, k=None):
         original_query: The question to answer
         project_name: Name of the project to query. If None, uses DEFAULT_PROJECT from config.
         k: Number of chunks to retrieve. If None, uses config.k
+        filters: Optional dict restricting the search, see validate_filters
+        index_path: Search this index version instead of the project's current one
         evaluation: Whether this is an evaluation query
     
     Returns:
@@ -100,17 +287,21 @@ def rag_query(original_query, project_name=None, k=None):
     if k is None:
         k = config.k
     
-    index_path = config.get_index_path(project_name)
-    
-    if not os.path.exists(index_path):
-        raise ValueError(f"Project '{project_name}' has not been indexed. Index path not found: {index_path}")
-    
-    embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
+    # Fail on malformed filters before loading the model
+    filters = validate_filters(filters)
+
+    embedding_model = get_embedding_model()
     query_embedding = embed(embedding_model, original_query)
 
-    relevant_chunks = find_k_relevant_chunks(query_embedding, index_path, k)
+    relevant_chunks = find_k_relevant_chunks(query_embedding, project_name, k, filters=filters,
+                                             index_path=index_path)
+
+    context, stats = pack_context(relevant_chunks, query_embedding, embedding_model)
+    print(f"Packed {stats['packed_chunks']}/{stats['candidates']} candidates from "
+          f"{stats['retrieved_chunks']} chunks into ~{stats['context_tokens']}/"
+          f"{stats['token_budget']} context tokens")
 
-    system_prompt, user_prompt = build_new_query(relevant_chunks, original_query)
+    system_prompt, user_prompt = build_new_query(context, original_query)
 
     response = ping_llm(system_prompt, user_prompt)
     
@@ -118,8 +309,15 @@ def rag_query(original_query, project_name=None, k=None):
 
 
 
-def pubmed_query(original_query, k):
-    update_pubmed_queue(original_query)
+def pubmed_query(original_query, k, filters=None):
+    # Reject bad filters before spending time on the PubMed fetch and re-index.
+    # Whether the papers, sections and years exist depends on the fetched
+    # papers, so that is checked on the version built for this query
+    validate_filters(filters)
 
-    response = rag_query(original_query, project_name="pubmed_queue", k=k)
+    # Search the papers fetched for this question, even if another PubMed
+    # query re-indexes the queue in the meantime
+    with update_pubmed_queue(original_query) as index_path:
+        response = rag_query(original_query, project_name="pubmed_queue", k=k, filters=filters,
+                             index_path=index_path)
     return response
\ No newline at end of file
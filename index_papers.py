@@ -1,11 +1,15 @@
 import config
 import glob
+import json
 import os
-from sentence_transformers import SentenceTransformer
-import chromadb
 import re
+import shutil
+import time
 import pypdf
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from chroma_clients import close_client
+from dedup import dedup_chunks
+from embeddings import get_embedding_model
+from project_lock import project_write_lock, remove_index_version
 
 
 def extract_text_from_pdf(papers_dir, filename):
@@ -84,6 +88,8 @@ def chunk_paper(text, paper):
             })
     else:
         # Fallback to original recursive chunking
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
         text_chunker = RecursiveCharacterTextSplitter(
             chunk_size=config.CHUNK_SIZE,
             chunk_overlap=config.CHUNK_OVERLAP,
@@ -106,11 +112,15 @@ def chunk_paper(text, paper):
     return chunked_paper
 
 
+def chunk_id(i):
+    return f"chunk_{i}"
+
+
 def add_chunks_to_collection(collection, chunks, embedding_model):
     # Prepare data
     texts = [chunk['text'] for chunk in chunks]
     metadatas = [chunk['metadata'] for chunk in chunks]
-    ids = [f"chunk_{i}" for i in range(len(chunks))]
+    ids = [chunk_id(i) for i in range(len(chunks))]
     
     embeddings = embedding_model.encode(texts)
     
@@ -123,22 +133,174 @@ def add_chunks_to_collection(collection, chunks, embedding_model):
     )
 
 
-def index_papers(project_name):
+def new_index_version(project_name):
+    """
+    Create an empty directory for a new index version of a project.
+
+    Returns:
+        Tuple of (version name, path to the version directory)
+    """
+    version = f"v{time.time_ns()}"
+    version_path = f"{config.get_index_versions_path(project_name)}{version}/"
+    os.makedirs(version_path)
+    return version, version_path
+
+
+def activate_index_version(project_name, version):
+    """
+    Atomically point a project at a fully built index version.
+
+    The pointer is written to a temporary file and renamed over the old one,
+    so readers always see either the previous version or the new one.
+    """
+    pointer_path = config.get_index_pointer_path(project_name)
+    tmp_path = f"{pointer_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pointer_path)
+
+
+def prune_index_versions(project_name):
+    """
+    Delete retired index versions of a project that no query is reading.
+
+    The active version is never touched. A retired version still leased by a
+    query is left in place, and its last reader removes it on release.
+    """
+    versions_dir = config.get_index_versions_path(project_name)
+    active_path = os.path.normpath(config.get_index_path(project_name))
+
+    retired = []
+    legacy_path = config.get_legacy_index_path(project_name)
+    if os.path.isdir(legacy_path):
+        retired.append(legacy_path)
+    if os.path.isdir(versions_dir):
+        for version in sorted(os.listdir(versions_dir)):
+            version_path = os.path.join(versions_dir, version)
+            if os.path.normpath(version_path) != active_path:
+                retired.append(version_path)
+
+    for version_path in retired:
+        if remove_index_version(version_path):
+            print(f"Removed old index version: {version_path}")
+        else:
+            print(f"Old index version still in use, its last query will remove it: {version_path}")
+
+
+def write_filter_options(version_path, chunks):
+    """
+    Save the values queries can filter an index version by.
+
+    The papers, sections and year range are collected once at index time so
+    the UI can offer them without scanning the collection.
+
+    A deduplicated chunk stands for every paper and section it was merged
+    from, which its own metadata can't express. 'chunk_members' maps each
+    chunk id to the (paper, section) pairs it covers, and queries filter by
+    papers and sections through those ids instead of a where clause.
+    """
+    sources = set()
+    sections = set()
+    years = []
+    chunk_members = {}
+    for i, chunk in enumerate(chunks):
+        members = []
+        for metadata in [chunk['metadata']] + chunk.get('merged_metadata', []):
+            source = metadata.get('source')
+            section = metadata.get('section')
+            if source is not None:
+                sources.add(source)
+            if section is not None:
+                sections.add(section)
+            if 'year' in metadata:
+                years.append(metadata['year'])
+            members.append([source, section])
+        chunk_members[chunk_id(i)] = members
+
+    filter_options = {
+        'papers': sorted(sources),
+        'sections': sorted(sections),
+        'year_min': min(years) if years else None,
+        'year_max': max(years) if years else None,
+        'chunk_members': chunk_members
+    }
+    with open(os.path.join(version_path, config.FILTERS_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(filter_options, f)
+
+
+def build_index(project_name, chunks):
+    """
+    Build a fresh index for a project and switch queries over to it.
+
+    The collection is built in a new version directory while the current index
+    keeps serving queries, then the project is swapped to it atomically.
+
+    Args:
+        project_name: Name of the project
+        chunks: List of chunk dicts with 'text' and 'metadata'
+
+    Returns:
+        Path to the new index version
+    """
+    import chromadb
+
+    if config.DEDUP_ENABLED:
+        chunks, report = dedup_chunks(chunks)
+        print(f"Removed {report['chunks_removed']} near-duplicate chunks "
+              f"({report['chunks_before']} → {report['chunks_after']}, "
+              f"{report['percent_saved']:.1f}% of text saved)")
+
+    version, version_path = new_index_version(project_name)
+    print(f"Building index version: {version_path}")
+
+    client = chromadb.PersistentClient(path=version_path)
+    try:
+        collection = client.create_collection(name=config.CHROMA_COLLECTION_NAME)
+        print(f"Created collection: {config.CHROMA_COLLECTION_NAME}")
+
+        embedding_model = get_embedding_model()
+        add_chunks_to_collection(collection, chunks, embedding_model)
+        write_filter_options(version_path, chunks)
+    except Exception:
+        close_client(client)
+        shutil.rmtree(version_path, ignore_errors=True)
+        raise
+
+    # Queries open their own clients, this one would otherwise stay cached
+    close_client(client)
+
+    activate_index_version(project_name, version)
+    print(f"Activated index version: {version}")
+
+    prune_index_versions(project_name)
+    print(f"✓ Successfully indexed {len(chunks)} chunks for project '{project_name}'")
+    return version_path
+
+
+def index_papers(project_name, blocking=True):
     """
     Index all PDF papers in a project's papers directory.
     
     Args:
         project_name: Name of the project to index.
+        blocking: Wait for another index job on the project to finish. If
+            False, raise ProjectLockedError instead.
     """
     if project_name is None:
         raise ValueError(f"no project to index")
     
+    with project_write_lock(project_name, blocking=blocking):
+        _index_papers(project_name)
+
+
+def _index_papers(project_name):
     papers_dir = config.get_papers_path(project_name)
-    index_path = config.get_index_path(project_name)
     
     print(f"\n=== Indexing Project: {project_name} ===")
     print(f"Papers directory: {papers_dir}")
-    print(f"Index directory: {index_path}")
+    print(f"Index directory: {config.get_index_versions_path(project_name)}")
     
     if not os.path.exists(papers_dir):
         raise ValueError(f"Papers directory not found: {papers_dir}")
@@ -166,22 +328,4 @@ def index_papers(project_name):
     
     print(f"\nTotal chunks created: {len(all_chunks)}")
 
-    # Create ChromaDB index
-    os.makedirs(index_path, exist_ok=True)
-    client = chromadb.PersistentClient(path=index_path)
-    
-    # Delete existing collection if it exists
-    try:
-        client.delete_collection(name=config.CHROMA_COLLECTION_NAME)
-        print("Deleted existing collection")
-    except:
-        pass
-    
-    collection = client.create_collection(name=config.CHROMA_COLLECTION_NAME)
-    print(f"Created collection: {config.CHROMA_COLLECTION_NAME}")
-    
-    embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
-    print(f"Loaded embedding model: {config.EMBEDDING_MODEL}")
-
-    add_chunks_to_collection(collection, all_chunks, embedding_model)
-    print(f"✓ Successfully indexed {len(all_chunks)} chunks for project '{project_name}'")
+    build_index(project_name, all_chunks)
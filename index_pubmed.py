@@ -1,11 +1,10 @@
 import config
 import os
-from sentence_transformers import SentenceTransformer
-import chromadb
 import requests
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import xml.etree.ElementTree as ET
-from index_papers import add_chunks_to_collection
+from contextlib import ExitStack, contextmanager
+from index_papers import build_index
+from project_lock import index_read_lease, project_write_lock
 
 
 BASE = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
@@ -118,6 +117,8 @@ def chunk_pubmed_paper(paper_data):
     Chunk a PubMed paper (which is just title + abstract).
     Since abstracts are usually short, we'll chunk conservatively.
     """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     chunked_paper = []
     
     full_text = paper_data['full_text']
@@ -133,16 +134,19 @@ def chunk_pubmed_paper(paper_data):
     chunks = text_chunker.split_text(full_text)
     
     for i, chunk in enumerate(chunks):
+        metadata = {
+            'source': f"PMID:{paper_data['pmid']}",
+            'title': paper_data['title'],
+            'authors': paper_data['authors'],
+            'journal': paper_data['journal'],
+            'chunk_id': i
+        }
+        # Stored as an int so year ranges can be filtered in the vector search
+        if paper_data['year'].isdigit():
+            metadata['year'] = int(paper_data['year'])
         chunked_paper.append({
             'text': chunk,
-            'metadata': {
-                'source': f"PMID:{paper_data['pmid']}",
-                'title': paper_data['title'],
-                'authors': paper_data['authors'],
-                'journal': paper_data['journal'],
-                'year': paper_data['year'],
-                'chunk_id': i
-            }
+            'metadata': metadata
         })
     
     return chunked_paper
@@ -178,11 +182,12 @@ def index_pubmed_papers(project_name, papers):
     Args:
         project_name: Name of the project
         papers: List of paper dicts from parse_pubmed_xml
+
+    Returns:
+        Path to the new index version
     """
-    index_path = config.get_index_path(project_name)
-    
     print(f"\n=== Indexing PubMed Papers for: {project_name} ===")
-    print(f"Index directory: {index_path}")
+    print(f"Index directory: {config.get_index_versions_path(project_name)}")
     print(f"Number of papers: {len(papers)}")
     
     all_chunks = []
@@ -195,37 +200,26 @@ def index_pubmed_papers(project_name, papers):
     
     print(f"\nTotal chunks created: {len(all_chunks)}")
     
-    # Create ChromaDB index
-    os.makedirs(index_path, exist_ok=True)
-    client = chromadb.PersistentClient(path=index_path)
-    
-    # Delete existing collection if it exists
-    try:
-        client.delete_collection(name=config.CHROMA_COLLECTION_NAME)
-        print("Deleted existing collection")
-    except:
-        pass
-    
-    collection = client.create_collection(name=config.CHROMA_COLLECTION_NAME)
-    print(f"Created collection: {config.CHROMA_COLLECTION_NAME}")
-    
-    embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
-    print(f"Loaded embedding model: {config.EMBEDDING_MODEL}")
-    
-    add_chunks_to_collection(collection, all_chunks, embedding_model)
-    print(f"✓ Successfully indexed {len(all_chunks)} chunks for project '{project_name}'")
+    return build_index(project_name, all_chunks)
 
 
+@contextmanager
 def update_pubmed_queue(original_query, k=None):
     """
-    Find relevant PubMed papers and index them to the queue.
+    Find relevant PubMed papers, index them to the queue and lease that index.
+
+    Concurrent PubMed queries share the queue, so the version built for this
+    query is leased before the write lock is released. Another query's
+    re-index then can't swap in its own papers or prune this version before
+    this query has searched it.
     
     Args:
         original_query: The user's question
         k: Number of papers to retrieve (defaults to config.k)
     
-    Returns:
-        Number of papers indexed
+    Yields:
+        Path to the index version built for this query, or None if PubMed
+        found no papers
     """
     if k is None:
         k = config.k
@@ -239,7 +233,8 @@ def update_pubmed_queue(original_query, k=None):
     
     if not pmids:
         print("No papers found for this query")
-        return 0
+        yield None
+        return
     
     print(f"Found {len(pmids)} papers: {pmids}")
     
@@ -250,10 +245,13 @@ def update_pubmed_queue(original_query, k=None):
     papers = parse_pubmed_xml(xml_text)
     print(f"Successfully parsed {len(papers)} papers")
     
-    # Step 4: Index papers directly (more efficient than saving then indexing)
-    index_pubmed_papers("pubmed_queue", papers)
-    
-    # Optional: Also save papers to disk for reference
-    # add_papers_to_project(papers, "pubmed_queue")
-    
-    return len(papers)
\ No newline at end of file
+    with ExitStack() as lease:
+        # Step 4: Index papers directly (more efficient than saving then indexing)
+        with project_write_lock("pubmed_queue"):
+            index_path = index_pubmed_papers("pubmed_queue", papers)
+            lease.enter_context(index_read_lease("pubmed_queue", index_path))
+        
+        # Optional: Also save papers to disk for reference
+        # add_papers_to_project(papers, "pubmed_queue")
+        
+        yield index_path
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Measure cold start time and per-worker memory of the app under gunicorn.
+
+Runs the app with PRELOAD_APP=1 and PRELOAD_APP=0 and reports for each mode:
+- time until /api/projects first answers
+- RSS and PSS of every worker right after startup and after the embedding
+  model has been used by every worker (PSS counts copy-on-write shared pages
+  once across processes, so it shows what preloading saves)
+
+Queries are sent without an API key, so they load the embedding model and
+search the index, then fail at the LLM call. That is enough to warm a worker.
+
+Linux only (memory is read from /proc). Usage:
+    python measure_startup.py [--workers 4] [--import-runs 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from sample_pdf import write_pdf
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import_time(runs):
+    """Median seconds to import app in a fresh interpreter"""
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, capture_output=True,
+                             text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def request(port, method, path, body=None, files=None):
+    url = f"http://127.0.0.1:{port}{path}"
+    headers = {}
+    data = None
+    if files is not None:
+        boundary = "measure-startup-boundary"
+        parts = []
+        for name in files:
+            with open(name, "rb") as f:
+                content = f.read()
+            parts.append(
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"files\"; "
+                f"filename=\"{os.path.basename(name)}\"\r\nContent-Type: application/pdf\r\n\r\n".encode()
+                + content + b"\r\n")
+        data = b"".join(parts) + f"--{boundary}--\r\n".encode()
+        headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+    elif body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(url, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=600) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def memory_kb(pid):
+    """RSS and PSS of a process in kB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key] = int(rest.split()[0])
+    return values["Rss"], values["Pss"]
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def worker_memory(master_pid):
+    return [memory_kb(pid) for pid in worker_pids(master_pid)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_mode(preload, workers):
+    workdir = tempfile.mkdtemp(prefix="measure_startup_")
+    port = free_port()
+    env = {**os.environ, "PRELOAD_APP": "1" if preload else "0"}
+    env.pop("API_KEY", None)
+
+    command = [sys.executable, "-m", "gunicorn", "--chdir", workdir, "--pythonpath", REPO_DIR,
+               "--workers", str(workers), "--bind", f"127.0.0.1:{port}", "--timeout", "600"]
+    conf = os.path.join(REPO_DIR, "gunicorn.conf.py")
+    if os.path.exists(conf):
+        command += ["-c", conf]
+    command.append("app:app")
+
+    start = time.perf_counter()
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                if request(port, "GET", "/api/projects") == 200:
+                    break
+            except OSError:
+                pass
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            time.sleep(0.05)
+        cold_start = time.perf_counter() - start
+        # Let every worker finish booting before reading memory
+        time.sleep(2)
+        idle = worker_memory(server.pid)
+
+        pdf_path = os.path.join(workdir, "measure.pdf")
+        write_pdf(pdf_path, [f"Sentence {i} about cells, proteins and measurements." for i in range(40)])
+        request(port, "POST", "/api/projects", body={"name": "measure"})
+        request(port, "POST", "/api/projects/measure/papers", files=[pdf_path])
+        if request(port, "POST", "/api/projects/measure/index") != 200:
+            raise RuntimeError("indexing the measurement project failed")
+
+        # Concurrent queries so that every sync worker handles at least one
+        with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+            list(pool.map(lambda _: request(port, "POST", "/api/projects/measure/query",
+                                            body={"query": "What was measured?"}),
+                          range(workers * 4)))
+        warm = worker_memory(server.pid)
+        master = memory_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return cold_start, master, idle, warm
+
+
+def describe(label, values):
+    rss = [rss for rss, _ in values]
+    pss = [pss for _, pss in values]
+    return (f"  {label}: RSS {statistics.mean(rss) / 1024:.0f} MB/worker, "
+            f"PSS {statistics.mean(pss) / 1024:.0f} MB/worker, "
+            f"PSS total {sum(pss) / 1024:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--import-runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"import app: {measure_import_time(args.import_runs):.2f}s (median of {args.import_runs})")
+    for preload in (True, False):
+        cold_start, master, idle, warm = run_mode(preload, args.workers)
+        print(f"PRELOAD_APP={int(preload)}, {args.workers} workers")
+        print(f"  first /api/projects response: {cold_start:.2f}s")
+        print(f"  master: RSS {master[0] / 1024:.0f} MB, PSS {master[1] / 1024:.0f} MB")
+        print(describe("after startup", idle))
+        print(describe("after queries", warm))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import config
+import math
+import numpy as np
+
+
+def estimate_tokens(text):
+    """Rough LLM token count, based on config.CHARS_PER_TOKEN"""
+    return math.ceil(len(text) / config.CHARS_PER_TOKEN)
+
+
+def cosine_similarity(a, b):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norm) if norm else 0.0
+
+
+def split_oversized(chunks, query_embedding, embedding_model, max_tokens=None):
+    """
+    Split chunks above max_tokens into pieces and score each piece on its own.
+
+    Section-mode chunks have no size cap, so only the parts of a long section
+    that actually match the query should compete for the context budget.
+
+    Args:
+        chunks: List of dicts with 'text', 'metadata' and 'embedding'
+        query_embedding: Embedding of the user's question
+        embedding_model: SentenceTransformer used to embed the pieces
+        max_tokens: Largest piece allowed. If None, uses config.CONTEXT_MAX_CHUNK_TOKENS
+
+    Returns:
+        List of candidate dicts with 'text', 'metadata' and 'score'
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if max_tokens is None:
+        max_tokens = config.CONTEXT_MAX_CHUNK_TOKENS
+
+    text_chunker = RecursiveCharacterTextSplitter(
+        chunk_size=max_tokens * config.CHARS_PER_TOKEN,
+        chunk_overlap=0,
+        length_function=len,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+
+    candidates = []
+    pieces = []
+    for chunk in chunks:
+        if estimate_tokens(chunk['text']) <= max_tokens:
+            candidates.append({
+                'text': chunk['text'],
+                'metadata': chunk['metadata'],
+                'score': cosine_similarity(query_embedding, chunk['embedding'])
+            })
+        else:
+            for piece in text_chunker.split_text(chunk['text']):
+                pieces.append({'text': piece, 'metadata': chunk['metadata']})
+
+    if pieces:
+        # Embed all pieces in one batch rather than once per oversized chunk
+        piece_embeddings = embedding_model.encode([piece['text'] for piece in pieces])
+        for piece, embedding in zip(pieces, piece_embeddings):
+            piece['score'] = cosine_similarity(query_embedding, embedding)
+            candidates.append(piece)
+
+    return candidates
+
+
+def _overlap(left, right, max_chars):
+    """Length of the longest suffix of left that is also a prefix of right"""
+    for size in range(min(len(left), len(right), max_chars), config.CONTEXT_MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def remove_overlap(text, selected_texts):
+    """
+    Trim text shared with already selected chunks from the same paper.
+
+    Neighbouring chunks from the recursive splitter repeat up to
+    config.CHUNK_OVERLAP characters of each other.
+
+    Returns:
+        The trimmed text, or an empty string if it adds nothing new
+    """
+    max_chars = 2 * config.CHUNK_OVERLAP
+    for other in selected_texts:
+        if text in other:
+            return ""
+        text = text[_overlap(other, text, max_chars):]
+        end = _overlap(text, other, max_chars)
+        if end:
+            text = text[:-end]
+    return text.strip()
+
+
+def format_citation(text, metadata, score):
+    paper = metadata.get('source', 'Unknown')
+    page = metadata.get('page(s)', 'N/A')
+    return f"{text} (From: {paper}, Page(s): {page}, Similarity: {score:.4f})"
+
+
+def pack_context(chunks, query_embedding, embedding_model, token_budget=None):
+    """
+    Pack the most relevant text from retrieved chunks into a token budget.
+
+    Oversized chunks are split, candidates are taken greedily by similarity
+    to the query, and text overlapping an already packed chunk from the same
+    paper is trimmed. Every packed chunk keeps its paper/page citation.
+
+    Args:
+        chunks: List of dicts from find_k_relevant_chunks
+        query_embedding: Embedding of the user's question
+        embedding_model: SentenceTransformer used to embed split pieces
+        token_budget: Maximum context size. If None, uses config.CONTEXT_TOKEN_BUDGET
+
+    Returns:
+        Tuple of (context string, stats dict)
+    """
+    if token_budget is None:
+        token_budget = config.CONTEXT_TOKEN_BUDGET
+
+    candidates = split_oversized(chunks, query_embedding, embedding_model)
+    candidates.sort(key=lambda c: c['score'], reverse=True)
+
+    packed = []
+    selected_by_source = {}
+    used_tokens = 0
+    for candidate in candidates:
+        source = candidate['metadata'].get('source', 'Unknown')
+        text = remove_overlap(candidate['text'], selected_by_source.get(source, []))
+        if not text:
+            continue
+
+        entry = format_citation(text, candidate['metadata'], candidate['score'])
+        tokens = estimate_tokens(entry)
+        if used_tokens + tokens > token_budget:
+            # A smaller, less relevant candidate may still fit
+            continue
+
+        packed.append(entry)
+        selected_by_source.setdefault(source, []).append(text)
+        used_tokens += tokens
+
+    stats = {
+        'retrieved_chunks': len(chunks),
+        'candidates': len(candidates),
+        'packed_chunks': len(packed),
+        'context_tokens': used_tokens,
+        'token_budget': token_budget
+    }
+    return "\n\n".join(packed), stats
@@ -0,0 +1,205 @@
+import config
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, fall back to msvcrt byte-range locks
+    fcntl = None
+    import msvcrt
+
+
+# msvcrt has no shared locks, so on Windows each shared holder locks any free
+# byte out of this many and an exclusive holder locks all of them. Readers
+# only wait on each other once every slot is taken.
+_WINDOWS_SHARED_SLOTS = 64
+
+
+class ProjectLockedError(RuntimeError):
+    """Raised when another process is already writing to a project"""
+
+
+def _try_lock(lock_file, shared=False):
+    """
+    Try to lock a file without blocking.
+
+    Returns:
+        The (offset, length) byte range that was locked, to pass to _unlock,
+        or None if the lock is held by someone else
+    """
+    if fcntl is not None:
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(lock_file.fileno(), mode | fcntl.LOCK_NB)
+        except OSError:
+            return None
+        return 0, 0
+
+    ranges = [(slot, 1) for slot in range(_WINDOWS_SHARED_SLOTS)] if shared else [(0, _WINDOWS_SHARED_SLOTS)]
+    for offset, length in ranges:
+        lock_file.seek(offset)
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, length)
+        except OSError:
+            continue
+        return offset, length
+    return None
+
+
+def _unlock(lock_file, lock_range):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        offset, length = lock_range
+        lock_file.seek(offset)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, length)
+
+
+@contextmanager
+def project_write_lock(project_name, blocking=True):
+    """
+    Hold the exclusive, cross-process write lock for a project.
+
+    Only writers of a project's index (index jobs, project deletion) take this
+    lock. Queries never do: they read the CURRENT_INDEX pointer, which is
+    swapped atomically, and only ever open fully built index versions.
+
+    Args:
+        project_name: Name of the project
+        blocking: Wait for the lock if it is held. If False, raise
+            ProjectLockedError instead
+
+    The lock is advisory and lives outside the project directory, so the
+    project can be deleted while it is held.
+    """
+    os.makedirs(config.LOCKS_DIR, exist_ok=True)
+    lock_file = open(config.get_lock_path(project_name), 'a+')
+    try:
+        lock_range = _try_lock(lock_file)
+        while lock_range is None:
+            if not blocking:
+                raise ProjectLockedError(f"Project '{project_name}' is being indexed or modified by another request")
+            time.sleep(config.LOCK_POLL_INTERVAL)
+            lock_range = _try_lock(lock_file)
+        try:
+            yield
+        finally:
+            _unlock(lock_file, lock_range)
+    finally:
+        lock_file.close()
+
+
+def _acquire_read_lease(index_path):
+    """
+    Take a shared lease on an index version.
+
+    Returns:
+        Tuple of (open lease file, locked range), or None if the version was
+        deleted before the lease was taken
+    """
+    try:
+        lease_file = open(os.path.join(index_path, config.READER_LOCK_FILENAME), 'a+')
+    except FileNotFoundError:
+        return None
+
+    # Only blocks while a retired version is being deleted
+    lock_range = _try_lock(lease_file, shared=True)
+    while lock_range is None:
+        time.sleep(config.LOCK_POLL_INTERVAL)
+        lock_range = _try_lock(lease_file, shared=True)
+
+    if not os.path.exists(os.path.join(index_path, 'chroma.sqlite3')):
+        _unlock(lease_file, lock_range)
+        lease_file.close()
+        return None
+    return lease_file, lock_range
+
+
+@contextmanager
+def index_read_lease(project_name, index_path=None):
+    """
+    Resolve a project's current index version and keep it alive while in use.
+
+    Readers share the lease, so they never wait on each other or on index
+    builds. Retired versions are only deleted once no reader holds them: by
+    prune_index_versions after a re-index, or here by the last reader of a
+    version that was retired while it was being read.
+
+    Args:
+        project_name: Name of the project
+        index_path: Lease this exact index version instead of the current one
+
+    Yields:
+        Path to the index version being read
+    """
+    if index_path is not None:
+        lease = _acquire_read_lease(index_path)
+        if lease is None:
+            raise ValueError(f"Index version of project '{project_name}' no longer exists: {index_path}")
+    else:
+        lease = None
+        for _ in range(config.READ_LEASE_ATTEMPTS):
+            index_path = config.get_index_path(project_name)
+            lease = _acquire_read_lease(index_path)
+            if lease is not None:
+                break
+        if lease is None:
+            raise ValueError(f"Project '{project_name}' has not been indexed. Index path not found: {index_path}")
+
+    lease_file, lock_range = lease
+    try:
+        yield index_path
+    finally:
+        _unlock(lease_file, lock_range)
+        lease_file.close()
+        if os.path.normpath(index_path) != os.path.normpath(config.get_index_path(project_name)):
+            if remove_index_version(index_path):
+                print(f"Removed old index version: {index_path}")
+
+
+def _remove_index_contents(index_path):
+    """Delete everything in an index version except its reader lease file"""
+    for name in os.listdir(index_path):
+        if name == config.READER_LOCK_FILENAME:
+            continue
+        path = os.path.join(index_path, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def remove_index_version(index_path):
+    """
+    Delete a retired index version unless a query still holds a lease on it.
+
+    Returns:
+        True if the version is gone, False if it is still in use
+    """
+    try:
+        lease_file = open(os.path.join(index_path, config.READER_LOCK_FILENAME), 'a+')
+    except FileNotFoundError:
+        shutil.rmtree(index_path, ignore_errors=True)
+        return True
+
+    try:
+        lock_range = _try_lock(lease_file)
+        if lock_range is None:
+            return False
+        try:
+            _remove_index_contents(index_path)
+        finally:
+            _unlock(lease_file, lock_range)
+    finally:
+        lease_file.close()
+
+    # The lease file stays open until the lease is released, and Windows
+    # can't delete open files, so it goes last
+    shutil.rmtree(index_path, ignore_errors=True)
+    return True
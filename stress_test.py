@@ -0,0 +1,253 @@
+"""
+Stress test for concurrent uploads, index jobs and queries on one project.
+
+Runs several processes against the same project for a fixed time and checks
+the consistency model:
+- a second writer gets ProjectLockedError, or a 409 from the API
+- every query opens a fully built index version (chroma.sqlite3 and
+  filters.json present) and never fails, however many re-indexes happen
+- index jobs never read a partially uploaded (.part) PDF
+
+The embedding model is replaced by a deterministic stub, so this runs
+without torch or network access. Usage:
+    python stress_test.py [--seconds 20] [--uploaders 2] [--indexers 2] [--queriers 4]
+"""
+import argparse
+import hashlib
+import io
+import multiprocessing as mp
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+
+from sample_pdf import pdf_bytes
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT = "stress"
+EMBEDDING_DIM = 16
+
+
+class StubEmbeddingModel:
+    """Hash-based stand-in for SentenceTransformer"""
+
+    def _embed(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return np.frombuffer(digest[:EMBEDDING_DIM], dtype=np.uint8).astype(np.float32) + 1
+
+    def encode(self, sentences):
+        if isinstance(sentences, str):
+            return self._embed(sentences)
+        return np.stack([self._embed(s) for s in sentences])
+
+
+def _setup_process(workdir):
+    """Run in every child: work in the shared directory and stub the model"""
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    # Index and query logging would drown the test output
+    sys.stdout = open(os.devnull, "w")
+    import index_papers
+    import handle_query
+    index_papers.get_embedding_model = StubEmbeddingModel
+    handle_query.get_embedding_model = StubEmbeddingModel
+
+
+def _run(role, body, workdir, deadline, results):
+    try:
+        _setup_process(workdir)
+        stats = body(deadline)
+        results.put((role, stats, None))
+    except Exception:
+        results.put((role, None, traceback.format_exc()))
+
+
+def create_project(deadline):
+    from app import app
+
+    client = app.test_client()
+    assert client.post("/api/projects", json={"name": PROJECT}).status_code == 200
+    papers = [(io.BytesIO(pdf_bytes([f"Seed paper {i} line {j} about proteins." for j in range(30)])),
+               f"seed_{i}.pdf") for i in range(3)]
+    response = client.post(f"/api/projects/{PROJECT}/papers", data={"files": papers},
+                           content_type="multipart/form-data")
+    assert response.status_code == 200
+    from index_papers import index_papers
+    index_papers(PROJECT)
+    return {}
+
+
+def check_writer_exclusion(deadline):
+    """Hold the project lock in a helper process and try to write from here"""
+    from app import app
+    from index_papers import index_papers
+    from project_lock import ProjectLockedError
+
+    ctx = mp.get_context("spawn")
+    held = ctx.Event()
+    release = ctx.Event()
+    holder = ctx.Process(target=_hold_lock, args=(os.getcwd(), held, release))
+    holder.start()
+    try:
+        assert held.wait(30), "lock holder did not start"
+        try:
+            index_papers(PROJECT, blocking=False)
+            raise AssertionError("second index job was not rejected")
+        except ProjectLockedError:
+            pass
+        client = app.test_client()
+        status = client.post(f"/api/projects/{PROJECT}/index").status_code
+        assert status == 409, f"index request during another write returned {status}"
+        status = client.delete(f"/api/projects/{PROJECT}").status_code
+        assert status == 409, f"delete request during another write returned {status}"
+    finally:
+        release.set()
+        holder.join()
+    return {}
+
+
+def _hold_lock(workdir, held, release):
+    _setup_process(workdir)
+    from project_lock import project_write_lock
+
+    with project_write_lock(PROJECT):
+        held.set()
+        release.wait(60)
+
+
+def uploader(deadline):
+    from app import app
+
+    client = app.test_client()
+    uploads = 0
+    while time.time() < deadline:
+        # Large enough that writing the file takes a moment
+        lines = [f"Upload {uploads} line {j} on enzyme kinetics and cell growth." for j in range(400)]
+        data = {"files": [(io.BytesIO(pdf_bytes(lines)), f"upload_{uploads % 3}.pdf")]}
+        response = client.post(f"/api/projects/{PROJECT}/papers", data=data,
+                               content_type="multipart/form-data")
+        assert response.status_code == 200, response.get_data(as_text=True)
+        uploads += 1
+    return {"uploads": uploads}
+
+
+def indexer(deadline):
+    import index_papers
+    from project_lock import ProjectLockedError
+
+    original_extract = index_papers.extract_text_from_pdf
+
+    def checked_extract(papers_dir, filename):
+        assert not filename.endswith(".part"), f"index job picked up partial upload {filename}"
+        # pypdf raises on a truncated file, so a half-written PDF fails here
+        return original_extract(papers_dir, filename)
+
+    index_papers.extract_text_from_pdf = checked_extract
+
+    built = rejected = 0
+    while time.time() < deadline:
+        try:
+            index_papers.index_papers(PROJECT, blocking=False)
+            built += 1
+        except ProjectLockedError:
+            rejected += 1
+            time.sleep(0.05)
+    return {"builds": built, "rejected": rejected}
+
+
+def check_version_complete(index_path, context):
+    import config
+
+    for name in ("chroma.sqlite3", config.FILTERS_FILENAME):
+        assert os.path.exists(os.path.join(index_path, name)), f"query {context} {index_path} without {name}"
+
+
+def querier(deadline):
+    import config
+    from chroma_clients import reader_client
+    from handle_query import find_k_relevant_chunks
+    from project_lock import index_read_lease
+
+    model = StubEmbeddingModel()
+    queries = 0
+    while time.time() < deadline:
+        embedding = model.encode(f"question {queries}").tolist()
+        with index_read_lease(PROJECT) as index_path:
+            check_version_complete(index_path, "opened")
+            with reader_client(PROJECT, index_path) as client:
+                collection = client.get_collection(name=config.CHROMA_COLLECTION_NAME)
+                results = collection.query(query_embeddings=[embedding], n_results=3)
+                assert results["ids"][0], f"query on {index_path} returned nothing"
+            # Stand in for a slow search, then make sure no re-index pruned
+            # the version while it was leased
+            time.sleep(0.05)
+            check_version_complete(index_path, "lost files while leased:")
+        # The normal query path as well, which takes its own lease
+        assert find_k_relevant_chunks(embedding, PROJECT, k=3)
+        queries += 1
+    return {"queries": queries}
+
+
+def run_phase(ctx, workdir, roles, seconds):
+    results = ctx.Queue()
+    deadline = time.time() + seconds
+    processes = [ctx.Process(target=_run, args=(name, body, workdir, deadline, results))
+                 for name, body in roles]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--uploaders", type=int, default=2)
+    parser.add_argument("--indexers", type=int, default=2)
+    parser.add_argument("--queriers", type=int, default=4)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    workdir = tempfile.mkdtemp(prefix="stress_test_")
+    failures = []
+    totals = {}
+    try:
+        phases = [
+            ([("setup", create_project)], 0),
+            ([("writer exclusion", check_writer_exclusion)], 0),
+            ([(f"uploader {i}", uploader) for i in range(args.uploaders)]
+             + [(f"indexer {i}", indexer) for i in range(args.indexers)]
+             + [(f"querier {i}", querier) for i in range(args.queriers)], args.seconds),
+        ]
+        for roles, seconds in phases:
+            for role, stats, error in run_phase(ctx, workdir, roles, seconds):
+                if error:
+                    failures.append((role, error))
+                for key, value in (stats or {}).items():
+                    totals[key] = totals.get(key, 0) + value
+            if failures:
+                break
+
+        if not failures:
+            for key in ("uploads", "builds", "queries"):
+                if not totals.get(key):
+                    failures.append(("totals", f"no {key} completed during the run"))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(", ".join(f"{key}: {value}" for key, value in totals.items()))
+    for role, error in failures:
+        print(f"FAILED in {role}:\n{error}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()